@@ -0,0 +1,166 @@
+"""
+Admin tool for bulk loading data.
+
+    python admin.py seed-habits habits.json
+    python admin.py import-users users.csv --workers 8
+
+habits.json is a list of {"habit_id"?, "habit_name", "description", "sentences": [...]}.
+users.csv has a header row with username, email and password columns.
+"""
+import os
+import csv
+import json
+import uuid
+import logging
+import argparse
+from io import StringIO
+from concurrent.futures import ProcessPoolExecutor
+
+import utils
+from connection import Database
+
+
+logger = logging.getLogger()
+
+SENTENCE_MODEL = "all-MiniLM-L6-v2"
+
+
+def copy_field(value) -> str:
+    """Escape a value for COPY ... FROM STDIN text format."""
+    if value is None:
+        return "\\N"
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+def text_array(values) -> str:
+    """Postgres array literal for a list of strings."""
+    items = ('"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"' for value in values)
+    return "{" + ",".join(items) + "}"
+
+
+def embeddings_bytea(embeddings) -> str:
+    """Hex bytea literal of a 2D array packed as little-endian float32 rows."""
+    return "\\x" + embeddings.astype("<f4").tobytes().hex()
+
+
+def copy_rows(cursor, table: str, columns, rows):
+    buffer = StringIO()
+    for row in rows:
+        buffer.write("\t".join(copy_field(value) for value in row) + "\n")
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+def seed_habits(database: Database, path: str, batch_size: int):
+    from sentence_transformers import SentenceTransformer
+
+    with open(path) as f:
+        habits = {}
+        for habit in json.load(f):
+            habit_id = str(uuid.UUID(habit["habit_id"])) if habit.get("habit_id") else str(uuid.uuid4())
+            habits[habit_id] = habit
+
+    # Encode every sentence of every habit in one batched pass, then split per habit
+    sentences = [sentence for habit in habits.values() for sentence in habit["sentences"]]
+    model = SentenceTransformer(SENTENCE_MODEL)
+    embeddings = model.encode(sentences, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=True)
+
+    rows = []
+    offset = 0
+    for habit_id, habit in habits.items():
+        count = len(habit["sentences"])
+        rows.append((habit_id, habit["habit_name"], habit.get("description"),
+                     text_array(habit["sentences"]), embeddings_bytea(embeddings[offset:offset + count])))
+        offset += count
+
+    conn = database.get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("CREATE TEMP TABLE habits_staging (LIKE habits) ON COMMIT DROP;")
+            copy_rows(cursor, "habits_staging",
+                      ("habit_id", "habit_name", "description", "sentences", "embeddings"), rows)
+            cursor.execute("""
+                INSERT INTO habits (habit_id, habit_name, description, sentences, embeddings)
+                SELECT habit_id, habit_name, description, sentences, embeddings FROM habits_staging
+                ON CONFLICT (habit_id) DO UPDATE
+                SET habit_name = EXCLUDED.habit_name,
+                    description = EXCLUDED.description,
+                    sentences = EXCLUDED.sentences,
+                    embeddings = EXCLUDED.embeddings;
+            """)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        database.release_connection(conn)
+
+    logger.info(f"Seeded {len(rows)} habits from {len(sentences)} sentences")
+
+
+def import_users(database: Database, path: str, workers: int):
+    with open(path, newline="") as f:
+        users = list(csv.DictReader(f))
+
+    # bcrypt is deliberately slow, spread the hashing over all cores
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        hashes = list(executor.map(utils.get_password_hash, (user["password"] for user in users),
+                                   chunksize=max(1, len(users) // (workers * 4))))
+
+    rows = [(str(uuid.uuid4()), user["username"], user["email"], hashed_password)
+            for user, hashed_password in zip(users, hashes)]
+
+    conn = database.get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                CREATE TEMP TABLE users_staging (
+                    user_id UUID, username VARCHAR, email VARCHAR, password VARCHAR
+                ) ON COMMIT DROP;
+            """)
+            copy_rows(cursor, "users_staging", ("user_id", "username", "email", "password"), rows)
+            cursor.execute("""
+                INSERT INTO users (user_id, username, email, password)
+                SELECT user_id, username, email, password FROM users_staging
+                ON CONFLICT DO NOTHING;
+            """)
+            imported = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        database.release_connection(conn)
+
+    logger.info(f"Imported {imported} users, skipped {len(rows) - imported} existing usernames or emails")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Habito admin tool")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    habits_parser = subparsers.add_parser("seed-habits", help="Encode and load habit definitions")
+    habits_parser.add_argument("path", help="JSON file with habit definitions")
+    habits_parser.add_argument("--batch-size", type=int, default=64, help="Sentence encoding batch size")
+
+    users_parser = subparsers.add_parser("import-users", help="Bulk import users from a CSV file")
+    users_parser.add_argument("path", help="CSV file with username, email and password columns")
+    users_parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Password hashing processes")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    database = Database()
+    database.open_pool()
+    try:
+        if args.command == "seed-habits":
+            seed_habits(database, args.path, args.batch_size)
+        elif args.command == "import-users":
+            import_users(database, args.path, args.workers)
+    finally:
+        database.close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import os
+import time
+import asyncio
+import logging
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+
+
+logger = logging.getLogger()
+load_dotenv()
+
+INFERENCE_CONCURRENCY = int(os.getenv("INFERENCE_CONCURRENCY", "2"))
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "16"))
+INFERENCE_PER_USER_LIMIT = int(os.getenv("INFERENCE_PER_USER_LIMIT", "2"))
+INFERENCE_QUEUE_TIMEOUT = float(os.getenv("INFERENCE_QUEUE_TIMEOUT", "30"))
+INFERENCE_RETRY_AFTER = int(os.getenv("INFERENCE_RETRY_AFTER", "5"))
+
+
+class AdmissionController:
+    """
+    Bounds concurrent model work and sheds load instead of queueing without limit.
+
+    At most `max_concurrency` requests run inference at once and at most `max_queue`
+    wait for a slot. Waiting requests are served round-robin across users, and a user
+    may hold at most `per_user_limit` running or queued requests, so one client cannot
+    monopolize the model. Inference runs on a dedicated thread pool sized to the
+    concurrency limit, so it never blocks the event loop or the threadpool FastAPI
+    uses for auth and read endpoints.
+
+    Must only be used from the event loop thread.
+    """
+
+    def __init__(self, max_concurrency: int = INFERENCE_CONCURRENCY, max_queue: int = INFERENCE_QUEUE_SIZE,
+                 per_user_limit: int = INFERENCE_PER_USER_LIMIT, queue_timeout: float = INFERENCE_QUEUE_TIMEOUT,
+                 retry_after: int = INFERENCE_RETRY_AFTER):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.per_user_limit = per_user_limit
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="inference")
+
+        self.draining = False
+        self._active = 0
+        self._queued = 0
+        self._per_user = Counter()
+        self._waiting = OrderedDict()
+        self._counters = Counter()
+
+
+    def metrics(self):
+        return {
+            "active": self._active,
+            "queued": self._queued,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "admitted_total": self._counters["admitted"],
+            "queued_total": self._counters["queued"],
+            "shed_total": self._counters["shed"],
+            "shed_queue_full_total": self._counters["shed_queue_full"],
+            "shed_user_limit_total": self._counters["shed_user_limit"],
+            "shed_timeout_total": self._counters["shed_timeout"],
+            "shed_draining_total": self._counters["shed_draining"],
+        }
+
+
+    def _shed(self, reason: str, status_code: int = status.HTTP_503_SERVICE_UNAVAILABLE):
+        self._counters["shed"] += 1
+        self._counters[f"shed_{reason}"] += 1
+        logger.error(f"{status_code}: Inference request shed ({reason})")
+        raise HTTPException(
+            status_code=status_code,
+            detail="Server is busy verifying other habits, please retry shortly",
+            headers={"Retry-After": str(self.retry_after)},
+        )
+
+
+    @asynccontextmanager
+    async def admit(self, user_id: str):
+        if self.draining:
+            self._shed("draining")
+        if self._per_user[user_id] >= self.per_user_limit:
+            self._shed("user_limit", status.HTTP_429_TOO_MANY_REQUESTS)
+
+        if self._active < self.max_concurrency and not self._queued:
+            self._active += 1
+            self._per_user[user_id] += 1
+        else:
+            if self._queued >= self.max_queue:
+                self._shed("queue_full")
+            await self._wait_for_slot(user_id)
+
+        self._counters["admitted"] += 1
+        try:
+            yield
+        finally:
+            self._per_user[user_id] -= 1
+            if not self._per_user[user_id]:
+                del self._per_user[user_id]
+            self._active -= 1
+            self._wake_next()
+
+
+    async def _wait_for_slot(self, user_id: str):
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(user_id, deque()).append(waiter)
+        self._queued += 1
+        self._per_user[user_id] += 1
+        self._counters["queued"] += 1
+
+        try:
+            await asyncio.wait_for(waiter, timeout=self.queue_timeout)
+
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # A slot was handed over just as we gave up, pass it on
+                self._active -= 1
+                self._wake_next()
+            else:
+                self._remove_waiter(user_id, waiter)
+
+            self._per_user[user_id] -= 1
+            if not self._per_user[user_id]:
+                del self._per_user[user_id]
+
+            if isinstance(e, asyncio.TimeoutError):
+                self._shed("timeout")
+            raise
+
+
+    def _remove_waiter(self, user_id: str, waiter):
+        waiters = self._waiting.get(user_id)
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            self._queued -= 1
+            if not waiters:
+                del self._waiting[user_id]
+
+
+    def _wake_next(self):
+        """Hand a free slot to the next waiting user, round-robin."""
+        while self._waiting and self._active < self.max_concurrency:
+            user_id, waiters = self._waiting.popitem(last=False)
+            waiter = waiters.popleft()
+            self._queued -= 1
+            if waiters:
+                self._waiting[user_id] = waiters
+
+            if not waiter.done():
+                self._active += 1
+                waiter.set_result(None)
+
+
+    async def run(self, func, *args):
+        """Run blocking model work on the inference thread pool."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+
+    async def drain(self, timeout: float):
+        """Stop admitting new requests and wait for running and queued ones to finish."""
+        self.draining = True
+        deadline = time.monotonic() + timeout
+        while (self._active or self._queued) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+
+        if self._active or self._queued:
+            logger.error(f"Inference drain timed out with {self._active} running and {self._queued} queued")
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,144 @@
+"""
+Compare the list endpoints before the FAST_RESPONSES change with FAST_RESPONSES on.
+
+    python benchmark.py --rows 1000 --repeat 200
+
+The baseline is how the endpoints worked before: RealDictCursor rows, validated
+against the response_model. Each path is measured in two steps, from the tuples
+psycopg2 reads off the wire:
+
+- rows: the baseline builds a RealDictRow per row, replaying the calls the C
+  cursor makes when a RealDictCursor fetches. FAST_RESPONSES runs
+  connection.fetchall_dicts over a tuple cursor. FAST_RESPONSES=false also reads
+  rows this way now, so this step is gained whether or not the flag is set.
+- serialize: the baseline does what FastAPI does with a response_model: it
+  validates every row, dumps it to JSON-compatible python and encodes it with the
+  stdlib json module. FAST_RESPONSES is a single orjson.dumps. Only this step
+  depends on the flag.
+
+/user/streaks builds its response in python from two queries, so its rows step
+covers the habits query (a RealDictRow per row against plain tuples). Its serialize
+step uses the built response. No database is needed, rows are synthetic but shaped
+like the real query results.
+"""
+import json
+import uuid
+import timeit
+import argparse
+import datetime
+from collections import namedtuple
+from typing import List, Optional
+
+import orjson
+from psycopg2.extras import RealDictRow
+from pydantic import TypeAdapter
+
+import models
+from connection import fetchall_dicts
+
+
+Column = namedtuple("Column", ["name"])
+
+
+class TupleCursor:
+    """Stands in for a plain psycopg2 cursor after execute()."""
+
+    def __init__(self, columns, rows):
+        self.description = [Column(name) for name in columns]
+        self.rows = rows
+
+
+    def fetchall(self):
+        return list(self.rows)
+
+
+def real_dict_rows(columns, rows):
+    """Build rows the way RealDictCursor does: the C cursor sets each column by index."""
+    mapping = {index: name for index, name in enumerate(columns)}
+    result = []
+    for row in rows:
+        real_dict_row = RealDictRow()
+        real_dict_row[RealDictRow] = mapping
+        for index, value in enumerate(row):
+            real_dict_row[index] = value
+        result.append(real_dict_row)
+    return result
+
+
+def habits_rows(count: int):
+    return (("habit_id", "habit_name", "description"),
+            [(str(uuid.uuid4()), f"Habit {i}", "Snap your book or e-reader while reading.") for i in range(count)])
+
+
+def user_habits_rows(count: int):
+    return (("user_habit_id", "habit_id", "start_date", "current_streak", "habit_name", "description"),
+            [(str(uuid.uuid4()), str(uuid.uuid4()), datetime.date(2024, 10, 1), i,
+              f"Habit {i}", "Writing in a journal or diary.") for i in range(count)])
+
+
+def leaderboard_rows(count: int):
+    return (("username", "current_streak"), [(f"user{i}", count - i) for i in range(count)])
+
+
+def streaks_rows(count: int):
+    return (("user_habit_id", "habit_name"), [(str(uuid.uuid4()), f"Habit {i}") for i in range(count)])
+
+
+def streaks_response(rows):
+    days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+    return [{"habit_name": habit_name, "breakdown": {day: (i + j) % 2 == 0 for j, day in enumerate(days)}}
+            for i, (_, habit_name) in enumerate(rows)]
+
+
+ENDPOINTS = [
+    ("/habits", models.GetHabitsResponse, habits_rows),
+    ("/user/habits", models.GetUserHabitsResponse, user_habits_rows),
+    ("/leaderboard", models.GetLeaderboardResponse, leaderboard_rows),
+    ("/user/streaks", models.GetStreakResponse, streaks_rows),
+]
+
+
+def measure(func, repeat: int) -> float:
+    """Best milliseconds per call."""
+    return min(timeit.repeat(func, number=repeat, repeat=3)) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark list endpoint row building and serialization")
+    parser.add_argument("--rows", type=int, default=1000, help="Rows per response")
+    parser.add_argument("--repeat", type=int, default=200, help="Responses built per measurement")
+    args = parser.parse_args()
+
+    print(f"{'endpoint':<16}{'step':<12}{'baseline (ms)':>15}{'FAST_RESPONSES (ms)':>21}{'speedup':>10}")
+    for path, model, make_rows in ENDPOINTS:
+        columns, rows = make_rows(args.rows)
+        adapter = TypeAdapter(List[Optional[model]])
+
+        if path == "/user/streaks":
+            baseline_rows = lambda: dict((row["user_habit_id"], row["habit_name"]) for row in real_dict_rows(columns, rows))
+            fast_rows = lambda: dict(TupleCursor(columns, rows).fetchall())
+            content = streaks_response(rows)
+        else:
+            baseline_rows = lambda: real_dict_rows(columns, rows)
+            fast_rows = lambda: fetchall_dicts(TupleCursor(columns, rows))
+            content = fast_rows()
+
+        def baseline_serialize():
+            dumped = adapter.dump_python(adapter.validate_python(content), mode="json")
+            return json.dumps(dumped, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+        def fast_serialize():
+            return orjson.dumps(content)
+
+        totals = [0.0, 0.0]
+        for step, baseline_path, fast_path in (("rows", baseline_rows, fast_rows),
+                                              ("serialize", baseline_serialize, fast_serialize)):
+            baseline_ms, fast_ms = measure(baseline_path, args.repeat), measure(fast_path, args.repeat)
+            totals[0] += baseline_ms
+            totals[1] += fast_ms
+            print(f"{path:<16}{step:<12}{baseline_ms:>15.3f}{fast_ms:>21.3f}{baseline_ms / fast_ms:>9.1f}x")
+        print(f"{path:<16}{'total':<12}{totals[0]:>15.3f}{totals[1]:>21.3f}{totals[0] / totals[1]:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
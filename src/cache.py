@@ -0,0 +1,247 @@
+import os
+import json
+import time
+import logging
+import datetime
+import threading
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+
+logger = logging.getLogger()
+load_dotenv()
+
+CACHE_TTL = int(os.getenv("CACHE_TTL", "300"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+# e.g. unix:///var/run/redis/redis.sock or redis://localhost:6379/0, leave unset to disable
+CACHE_SHARED_URL = os.getenv("CACHE_SHARED_URL")
+
+
+def seconds_until_midnight() -> int:
+    now = datetime.datetime.now()
+    midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time.min)
+    return max(1, int((midnight - now).total_seconds()))
+
+
+class LRUCache:
+    """
+    In-process LRU cache with per-entry expiry. Safe to share between threads.
+
+    Entries may be set with a `group`, all entries of a group can then be dropped at
+    once with delete_group().
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._groups = {}
+        self._lock = threading.Lock()
+
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value, _ = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+
+    def set(self, key, value, ttl: int, group=None):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, value, group)
+            if group is not None:
+                self._groups.setdefault(group, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+
+    def delete_group(self, group):
+        with self._lock:
+            for key in self._groups.get(group, set()).copy():
+                self._remove(key)
+
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._groups.clear()
+
+
+    def _remove(self, key):
+        _, _, group = self._entries.pop(key)
+        if group is not None:
+            keys = self._groups[group]
+            keys.discard(key)
+            if not keys:
+                del self._groups[group]
+
+
+class ResponseCache:
+    """
+    Two-tier cache keyed by (scope, name), e.g. ("user:<user_id>", "habits").
+
+    Every scope has a generation number. Invalidating a scope bumps its generation,
+    which orphans all entries cached under the old one without having to enumerate them.
+    When a shared tier is configured the generation lives there, so an invalidation
+    in one worker is seen by the local tier of every other worker on its next read.
+    Without one, writers also publish the invalidated scopes with pg_notify and every
+    worker's event broker applies them through invalidate_local().
+
+    The local tier drops the entries of an invalidated scope outright, so its bounded
+    generation table only has to catch reads that were in flight during an invalidation.
+    Generation numbers only ever increase and a scope that was evicted from the table
+    falls back to the highest evicted generation, so such a read is never cached.
+    """
+
+    def __init__(self, shared_url: str = CACHE_SHARED_URL, max_entries: int = CACHE_MAX_ENTRIES):
+        self.local = LRUCache(max_entries=max_entries)
+        self.shared = None
+        self.max_generations = max_entries
+        self._generations = OrderedDict()
+        self._counter = 0
+        self._floor = 0
+        self._lock = threading.Lock()
+
+        if shared_url:
+            try:
+                import redis
+
+                self.shared = redis.Redis.from_url(shared_url, socket_timeout=0.5)
+                logger.info(f"Shared response cache configured at {shared_url}")
+            except Exception as e:
+                logger.error(f"Shared response cache unavailable, using in-process tier only: {str(e)}")
+                self.shared = None
+
+
+    def _generation(self, scope: str) -> int:
+        if self.shared is not None:
+            try:
+                generation = self.shared.get(f"gen:{scope}")
+                return int(generation) if generation is not None else 0
+            except Exception as e:
+                logger.error(f"Shared cache read error: {str(e)}")
+                return -1
+
+        return self._local_generation(scope)
+
+
+    def _local_generation(self, scope: str) -> int:
+        with self._lock:
+            generation = self._generations.get(scope)
+            if generation is None:
+                return self._floor
+            self._generations.move_to_end(scope)
+            return generation
+
+
+    def get(self, scope: str, name: str):
+        """
+        Return (value, generation), value is None on a miss. Pass the generation back to
+        set() so rows read before a concurrent invalidation are never served from cache.
+        """
+        generation = self._generation(scope)
+        if generation < 0:
+            # Shared tier is down, we cannot tell whether local entries are stale
+            return None, generation
+
+        entry = self.local.get((scope, name))
+        # Local entries of a scope are dropped when it is invalidated in this worker,
+        # the shared generation also catches invalidations not yet applied here
+        if entry is not None and (self.shared is None or entry[0] == generation):
+            return entry[1], generation
+
+        if self.shared is not None:
+            key = f"{scope}:{generation}:{name}"
+            try:
+                raw = self.shared.get(key)
+                if raw is not None:
+                    value = json.loads(raw)
+                    ttl = self.shared.ttl(key)
+                    if ttl and ttl > 0:
+                        self.local.set((scope, name), (generation, value), ttl, group=scope)
+                    return value, generation
+            except Exception as e:
+                logger.error(f"Shared cache read error: {str(e)}")
+
+        return None, generation
+
+
+    def set(self, scope: str, name: str, value, generation: int, ttl: int = CACHE_TTL):
+        """Cache `value` under the generation returned by the get() that missed."""
+        if generation < 0:
+            return
+
+        if self.shared is not None:
+            try:
+                self.shared.set(f"{scope}:{generation}:{name}", json.dumps(value, default=str), ex=ttl)
+            except Exception as e:
+                logger.error(f"Shared cache write error: {str(e)}")
+            self.local.set((scope, name), (generation, value), ttl, group=scope)
+            return
+
+        # Checked and stored under the lock invalidations take, so none can slip in between
+        with self._lock:
+            if self._generations.get(scope, self._floor) != generation:
+                # Invalidated while the rows were being read
+                return
+            self.local.set((scope, name), (generation, value), ttl, group=scope)
+
+
+    def invalidate(self, scope: str):
+        if self.shared is not None:
+            try:
+                self.shared.incr(f"gen:{scope}")
+            except Exception as e:
+                logger.error(f"Shared cache invalidation error: {str(e)}")
+
+        self._bump_local(scope)
+
+
+    def _bump_local(self, scope: str):
+        with self._lock:
+            self._counter += 1
+            self._generations[scope] = self._counter
+            self._generations.move_to_end(scope)
+            while len(self._generations) > self.max_generations:
+                _, evicted = self._generations.popitem(last=False)
+                self._floor = max(self._floor, evicted)
+            self.local.delete_group(scope)
+
+
+    def invalidate_local(self, scopes=None):
+        """
+        Apply invalidations published by another worker. With scopes=None, e.g. after
+        missing notifications, everything cached in this worker is dropped.
+        """
+        if scopes is None:
+            with self._lock:
+                self._counter += 1
+                self._floor = self._counter
+                self._generations.clear()
+                self.local.clear()
+            return
+
+        for scope in scopes:
+            self._bump_local(scope)
+
+
+    def close(self):
+        self.local.clear()
+        if self.shared is not None:
+            self.shared.close()
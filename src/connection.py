@@ -10,6 +10,12 @@ logger = logging.getLogger()
 load_dotenv()
 
 
+def fetchall_dicts(cursor):
+    """Rows of a plain tuple cursor as dicts, much cheaper to build than RealDictRows."""
+    columns = [column.name for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
 class Database:
     def __init__(self):
         self.database_name = os.getenv("POSTGRES_DB")
@@ -18,11 +24,25 @@ class Database:
         self.host = os.getenv("POSTGRES_HOST")
         self.port = os.getenv("POSTGRES_PORT")
 
+        self.pool_min = int(os.getenv("POSTGRES_POOL_MIN", "1"))
+        self.pool_max = int(os.getenv("POSTGRES_POOL_MAX", "10"))
+        self.pool = None
+
+
+    def open_pool(self):
+        """
+        Create the connection pool. Called once per worker at startup rather than at
+        import, so no connection is ever inherited across a fork.
+        """
+        if self.pool:
+            return
+
         try:
             # Create a connection pool
-            self.pool = psycopg2.pool.SimpleConnectionPool(
-                minconn=1, 
-                maxconn=10,
+            # Handlers run in FastAPI's threadpool, so the pool must be thread safe
+            self.pool = psycopg2.pool.ThreadedConnectionPool(
+                minconn=self.pool_min, 
+                maxconn=self.pool_max,
                 dbname=self.database_name,
                 user=self.user_name,
                 password=self.password,
@@ -47,6 +67,21 @@ class Database:
             raise
 
 
+    def connect(self):
+        """Open a dedicated connection outside the pool, e.g. for LISTEN."""
+        try:
+            return psycopg2.connect(
+                dbname=self.database_name,
+                user=self.user_name,
+                password=self.password,
+                host=self.host,
+                port=self.port,
+            )
+        except psycopg2.DatabaseError as e:
+            logger.error(f"Failed to open a dedicated connection: {str(e)}")
+            raise
+
+
     def release_connection(self, conn):
         """Return the connection back to the pool."""
         try:
@@ -60,4 +95,5 @@ class Database:
         """Close the connection pool."""
         if self.pool:
             self.pool.closeall()
+            self.pool = None
             logger.info("Postgres connection pool closed successfully")
@@ -0,0 +1,8 @@
+-- Geohash cell (precision 5, see geo.GEOHASH_PRECISION) of users.location, used to
+-- bucket nearby leaderboard candidates. Safe to run against an existing database.
+ALTER TABLE users ADD COLUMN IF NOT EXISTS location_cell VARCHAR(12);
+
+UPDATE users SET location_cell = ST_GeoHash(location, 5)
+WHERE location IS NOT NULL AND location_cell IS NULL;
+
+CREATE INDEX IF NOT EXISTS users_location_cell_idx ON users (location_cell);
@@ -0,0 +1,26 @@
+-- Store habit embeddings as packed little-endian float32 (numpy "<f4") instead of
+-- FLOAT8[][], one row of the matrix after another. Decoded with numpy.frombuffer.
+-- Safe to run against an existing database, it only converts a FLOAT8[] column.
+CREATE OR REPLACE FUNCTION pg_temp.float8_array_to_f32le(arr FLOAT8[]) RETURNS BYTEA AS $$
+    -- float4send is big-endian, reverse the four bytes of every value
+    SELECT COALESCE(string_agg(
+        substring(b FROM 4 FOR 1) || substring(b FROM 3 FOR 1) ||
+        substring(b FROM 2 FOR 1) || substring(b FROM 1 FOR 1),
+        ''::BYTEA ORDER BY ord), ''::BYTEA)
+    FROM unnest(arr) WITH ORDINALITY AS t(x, ord),
+    LATERAL (SELECT float4send(x::FLOAT4) AS b) AS s;
+$$ LANGUAGE SQL IMMUTABLE;
+
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'habits' AND column_name = 'embeddings' AND data_type = 'ARRAY'
+    ) THEN
+        ALTER TABLE habits ADD COLUMN embeddings_f32 BYTEA;
+        UPDATE habits SET embeddings_f32 = pg_temp.float8_array_to_f32le(embeddings);
+        ALTER TABLE habits DROP COLUMN embeddings;
+        ALTER TABLE habits RENAME COLUMN embeddings_f32 TO embeddings;
+    END IF;
+END
+$$;
@@ -0,0 +1,297 @@
+import os
+import json
+import select
+import asyncio
+import logging
+import threading
+
+import psycopg2
+from dotenv import load_dotenv
+
+
+logger = logging.getLogger()
+load_dotenv()
+
+EVENTS_CHANNEL = os.getenv("EVENTS_CHANNEL", "habito_events")
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+
+LEADERBOARD_QUERY = """
+    SELECT u.username, uh.current_streak
+    FROM user_habits uh
+    JOIN users u ON uh.user_id = u.user_id
+    WHERE uh.habit_id = %s
+    ORDER BY current_streak DESC
+    LIMIT 10;
+"""
+
+
+def notify(cursor, event_type: str, **data):
+    """
+    Queue an event on the events channel. Postgres only delivers it once the
+    surrounding transaction commits, so listeners never see rolled back changes.
+    """
+    cursor.execute("SELECT pg_notify(%s, %s);",
+                   (EVENTS_CHANNEL, json.dumps({"type": event_type, **data}, default=str)))
+
+
+def notify_many(cursor, event_type: str, events):
+    """Like notify, but queues one event per dict in `events` with a single statement."""
+    payloads = [json.dumps({"type": event_type, **data}, default=str) for data in events]
+    if payloads:
+        cursor.execute("SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload;",
+                       (EVENTS_CHANNEL, payloads))
+
+
+def fetch_leaderboard(conn, habit_id: str):
+    with conn.cursor() as cursor:
+        cursor.execute(LEADERBOARD_QUERY, (habit_id,))
+        rows = cursor.fetchall()
+    return [{"rank": rank, "username": username, "current_streak": current_streak}
+            for rank, (username, current_streak) in enumerate(rows, start=1)]
+
+
+def leaderboard_diff(old, new):
+    """Entries of `new` that moved or changed streak, and usernames that dropped out."""
+    old_by_name = {entry["username"]: entry for entry in old}
+    new_names = {entry["username"] for entry in new}
+    return {
+        "updated": [entry for entry in new if old_by_name.get(entry["username"]) != entry],
+        "removed": [entry["username"] for entry in old if entry["username"] not in new_names],
+    }
+
+
+class Subscription:
+    def __init__(self, user_id: str, habit_ids):
+        self.user_id = user_id
+        self.habit_ids = set(habit_ids)
+        self.queue = asyncio.Queue(maxsize=EVENTS_QUEUE_SIZE)
+        self.closed = False
+
+
+    def push(self, event):
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Slow client, drop it so it reconnects and resyncs from a fresh snapshot
+            logger.error(f"Event queue full for user {self.user_id}, closing subscription")
+            self.close()
+
+
+    def close(self):
+        self.closed = True
+        # Wake up the stream so it can notice the subscription is closed
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class EventBroker:
+    """
+    Per-worker fan-out of database events to connected clients.
+
+    A background thread LISTENs on a dedicated connection. Every worker listens on its
+    own, so a change committed by one worker reaches the clients of all of them.
+    Events may carry the cache scopes the change invalidated, these are passed to
+    `on_invalidate`.
+    """
+
+    def __init__(self, database, on_invalidate=None):
+        self.database = database
+        self.on_invalidate = on_invalidate
+        self.loop = None
+        self._conn = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._by_user = {}
+        self._by_habit = {}
+        self._leaderboards = {}
+
+
+    def _connect(self):
+        conn = self.database.connect()
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {EVENTS_CHANNEL};")
+        return conn
+
+
+    def start(self, loop):
+        self.loop = loop
+        self._conn = self._connect()
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._listen, name="event-broker", daemon=True)
+        self._thread.start()
+        logger.info(f"Listening for events on channel {EVENTS_CHANNEL}")
+
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+        self.close_subscriptions()
+
+
+    def close_subscriptions(self):
+        """End every open stream, must be called from the event loop thread."""
+        with self._lock:
+            subscriptions = {sub for subs in self._by_user.values() for sub in subs}
+        for subscription in subscriptions:
+            subscription.close()
+
+
+    def subscribe(self, user_id: str, habit_ids) -> Subscription:
+        subscription = Subscription(user_id, habit_ids)
+        with self._lock:
+            self._by_user.setdefault(user_id, set()).add(subscription)
+            for habit_id in subscription.habit_ids:
+                self._by_habit.setdefault(habit_id, set()).add(subscription)
+        return subscription
+
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._discard(self._by_user, subscription.user_id, subscription)
+            for habit_id in subscription.habit_ids:
+                self._discard(self._by_habit, habit_id, subscription)
+                if habit_id not in self._by_habit:
+                    self._leaderboards.pop(habit_id, None)
+
+
+    @staticmethod
+    def _discard(index, key, subscription):
+        subscribers = index.get(key)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del index[key]
+
+
+    def leaderboard_snapshot(self, habit_id: str):
+        """Current leaderboard of a habit, read through the pool. Blocking."""
+        conn = self.database.get_connection()
+        try:
+            leaderboard = fetch_leaderboard(conn, habit_id)
+            conn.rollback()
+        finally:
+            self.database.release_connection(conn)
+
+        with self._lock:
+            if habit_id in self._by_habit:
+                self._leaderboards.setdefault(habit_id, leaderboard)
+        return leaderboard
+
+
+    def _listen(self):
+        while not self._stop.is_set():
+            try:
+                if select.select([self._conn], [], [], 1.0) == ([], [], []):
+                    continue
+
+                self._conn.poll()
+                events = []
+                while self._conn.notifies:
+                    notification = self._conn.notifies.pop(0)
+                    try:
+                        events.append(json.loads(notification.payload))
+                    except ValueError:
+                        logger.error(f"Malformed event payload: {notification.payload}")
+
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                logger.error(f"Event listener connection error: {str(e)}")
+                self._reconnect()
+                continue
+
+            self._handle(events)
+
+
+    def _reconnect(self):
+        """
+        Replace a broken LISTEN connection. Notifications sent while it was down are
+        lost, so drop this worker's caches and end the open streams, clients reconnect
+        and start again from a fresh snapshot.
+        """
+        try:
+            self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
+
+        delay = 1.0
+        while not self._stop.is_set():
+            try:
+                self._conn = self._connect()
+                break
+            except psycopg2.Error as e:
+                logger.error(f"Failed to reconnect event listener, retrying in {delay:.0f}s: {str(e)}")
+                self._stop.wait(delay)
+                delay = min(delay * 2, 30.0)
+
+        if self._conn is None:
+            return
+
+        logger.info(f"Event listener reconnected to channel {EVENTS_CHANNEL}")
+        with self._lock:
+            self._leaderboards.clear()
+        if self.on_invalidate:
+            self.on_invalidate(None)
+        self.loop.call_soon_threadsafe(self.close_subscriptions)
+
+
+    def _handle(self, events):
+        changed_habits = set()
+        scopes = {scope for event in events for scope in event.get("scopes", ())}
+        if scopes and self.on_invalidate:
+            try:
+                self.on_invalidate(scopes)
+            except Exception as e:
+                logger.error(f"Failed to apply cache invalidations: {str(e)}")
+
+        for event in events:
+            if event.get("type") == "streak":
+                self._publish_to_user(event["user_id"], {k: v for k, v in event.items() if k != "scopes"})
+            if event.get("habit_id"):
+                changed_habits.add(event["habit_id"])
+
+        # Recompute each affected leaderboard once per batch, and only if someone here watches it
+        for habit_id in changed_habits:
+            with self._lock:
+                if habit_id not in self._by_habit:
+                    continue
+                previous = self._leaderboards.get(habit_id, [])
+
+            try:
+                leaderboard = fetch_leaderboard(self._conn, habit_id)
+            except Exception as e:
+                # A broken connection is picked up and replaced by the next select
+                logger.error(f"Failed to refresh leaderboard of habit {habit_id}: {str(e)}")
+                continue
+
+            diff = leaderboard_diff(previous, leaderboard)
+            if not diff["updated"] and not diff["removed"]:
+                continue
+
+            with self._lock:
+                self._leaderboards[habit_id] = leaderboard
+                subscribers = list(self._by_habit.get(habit_id, ()))
+
+            event = {"type": "leaderboard", "habit_id": habit_id, **diff}
+            for subscription in subscribers:
+                self.loop.call_soon_threadsafe(subscription.push, event)
+
+
+    def _publish_to_user(self, user_id: str, event):
+        with self._lock:
+            subscribers = list(self._by_user.get(user_id, ()))
+        for subscription in subscribers:
+            self.loop.call_soon_threadsafe(subscription.push, event)
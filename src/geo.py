@@ -0,0 +1,93 @@
+import math
+
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+# Precision 5 cells are roughly 4.9km x 4.9km at the equator
+GEOHASH_PRECISION = 5
+EARTH_RADIUS_M = 6371008.8
+
+
+def geohash_encode(lat: float, lng: float, precision: int = GEOHASH_PRECISION) -> str:
+    """Same encoding as PostGIS ST_GeoHash."""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    cell = []
+    bits, bit_count, even = 0, 0, True
+
+    while len(cell) < precision:
+        value, value_range = (lng, lng_range) if even else (lat, lat_range)
+        mid = (value_range[0] + value_range[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            value_range[0] = mid
+        else:
+            bits = bits << 1
+            value_range[1] = mid
+
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            cell.append(GEOHASH_ALPHABET[bits])
+            bits, bit_count = 0, 0
+
+    return "".join(cell)
+
+
+def geohash_decode(cell: str):
+    """Return (lat, lng, lat_err, lng_err) of the cell center and its half sizes in degrees."""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    even = True
+
+    for char in cell:
+        bits = GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            value_range = lng_range if even else lat_range
+            mid = (value_range[0] + value_range[1]) / 2
+            if (bits >> shift) & 1:
+                value_range[0] = mid
+            else:
+                value_range[1] = mid
+            even = not even
+
+    lat = (lat_range[0] + lat_range[1]) / 2
+    lng = (lng_range[0] + lng_range[1]) / 2
+    return lat, lng, (lat_range[1] - lat_range[0]) / 2, (lng_range[1] - lng_range[0]) / 2
+
+
+def geohash_neighbors(cell: str):
+    """The cell itself and its (up to) eight surrounding cells."""
+    lat, lng, lat_err, lng_err = geohash_decode(cell)
+    cells = []
+    for dlat in (-1, 0, 1):
+        neighbor_lat = lat + dlat * 2 * lat_err
+        if not -90 < neighbor_lat < 90:
+            continue
+        for dlng in (-1, 0, 1):
+            neighbor_lng = (lng + dlng * 2 * lng_err + 180) % 360 - 180
+            neighbor = geohash_encode(neighbor_lat, neighbor_lng, len(cell))
+            if neighbor not in cells:
+                cells.append(neighbor)
+    return cells
+
+
+def neighborhood_radius(cell: str) -> float:
+    """
+    Distance in meters within which every point is guaranteed to lie in the 3x3 block
+    around `cell`, wherever in `cell` the caller is. Results farther than this may be
+    beaten by points outside the block.
+    """
+    lat, _, lat_err, lng_err = geohash_decode(cell)
+    widest_lat = min(90.0, abs(lat) + 3 * lat_err)
+    height = math.radians(2 * lat_err) * EARTH_RADIUS_M
+    width = math.radians(2 * lng_err) * EARTH_RADIUS_M * math.cos(math.radians(widest_lat))
+    return min(height, width)
+
+
+def haversine(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle distance in meters."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(1.0, a)))
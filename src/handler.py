@@ -1,7 +1,11 @@
+import json
 import uuid
+import asyncio
 import logging
 import psycopg2
 import datetime
+import numpy as np
+from typing import List
 from psycopg2.extras import RealDictCursor
 from psycopg2 import errors 
 from sentence_transformers import util
@@ -9,15 +13,46 @@ from sentence_transformers import util
 from fastapi import Depends, HTTPException, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi import UploadFile
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 
+import geo
+import events
 import models
 import utils
-from connection import Database
+from admission import AdmissionController
+from cache import ResponseCache, CACHE_TTL, seconds_until_midnight
+from connection import Database, fetchall_dicts
+from location_buffer import LocationBuffer
 
 from PIL import Image
 from io import BytesIO
 
 db_instance = Database()
+response_cache = ResponseCache()
+event_broker = events.EventBroker(db_instance, on_invalidate=response_cache.invalidate_local)
+inference_admission = AdmissionController()
+
+
+def cache_scopes(user_id: str, location_cell: str = None):
+    """Cache scopes invalidated by a change to a user's habits or streaks."""
+    scopes = [f"user:{user_id}"]
+    if location_cell:
+        scopes.append(f"cell:{location_cell}")
+    return scopes
+
+
+def invalidate_cells(cells):
+    for cell in cells:
+        response_cache.invalidate(f"cell:{cell}")
+
+
+location_buffer = LocationBuffer(db_instance, on_cells_changed=invalidate_cells)
+
+
+EVENTS_HEARTBEAT = 15
+EVENTS_MAX_HABITS = 20
+NEARBY_LIMIT = 5
 
 logger = logging.getLogger()
 
@@ -113,9 +148,9 @@ def get_habits_endpoint(token: str):
     try:
         conn = db_instance.get_connection()
 
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        with conn.cursor() as cursor:
             cursor.execute("SELECT habit_id, habit_name, description FROM habits;")
-            habits_data = cursor.fetchall()
+            habits_data = fetchall_dicts(cursor)
         
         if habits_data:
             return habits_data
@@ -142,10 +177,18 @@ def post_user_habit_endpoint(habit: models.PostUserHabitRequest, token: str):
         user_habit_id = str(uuid.uuid4())
 
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("INSERT INTO user_habits VALUES (%s, %s, %s, %s);",
-                (user_habit_id, payload["sub"], habit.habit_id, current_date))
+            cursor.execute("""
+                            INSERT INTO user_habits VALUES (%s, %s, %s, %s)
+                            RETURNING (SELECT location_cell FROM users WHERE user_id = %s) AS location_cell;
+                        """, (user_habit_id, payload["sub"], habit.habit_id, current_date, payload["sub"]))
+            location_cell = cursor.fetchone()["location_cell"]
+            events.notify(cursor, "enrolled", user_id=payload["sub"], habit_id=habit.habit_id,
+                          scopes=cache_scopes(payload["sub"], location_cell))
         
         conn.commit()
+        response_cache.invalidate(f"user:{payload['sub']}")
+        if location_cell:
+            response_cache.invalidate(f"cell:{location_cell}")
 
         return {
             "detail": "Habit added successfully"
@@ -173,12 +216,89 @@ def post_user_habit_endpoint(habit: models.PostUserHabitRequest, token: str):
 
 
 
-def get_user_habits_endpoint(token: str):
+def post_user_habits_endpoint(habits: models.PostUserHabitsRequest, token: str):
     payload = utils.verify_decode_token(token=token)
+    user_id = payload["sub"]
+
+    try:
+        habit_ids = [str(uuid.UUID(habit_id)) for habit_id in habits.habit_ids]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid habit_id")
+
+    if not habit_ids:
+        return []
+
+    conn = None
     try:
         conn = db_instance.get_connection()
+        current_date = datetime.date.today()
 
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            # Enroll in every existing habit at once, skipping the ones already added
+            cursor.execute("""
+                            WITH requested AS (
+                                SELECT DISTINCT unnest(%s::uuid[]) AS habit_id
+                            ),
+                            inserted AS (
+                                INSERT INTO user_habits (user_habit_id, user_id, habit_id, start_date)
+                                SELECT gen_random_uuid(), %s, h.habit_id, %s
+                                FROM habits h
+                                JOIN requested r ON h.habit_id = r.habit_id
+                                ON CONFLICT (user_id, habit_id) DO NOTHING
+                                RETURNING habit_id
+                            )
+                            SELECT r.habit_id,
+                                CASE WHEN i.habit_id IS NOT NULL THEN 'added'
+                                     WHEN h.habit_id IS NOT NULL THEN 'already_added'
+                                     ELSE 'not_found'
+                                END AS status,
+                                (SELECT location_cell FROM users WHERE user_id = %s) AS location_cell
+                            FROM requested r
+                            LEFT JOIN inserted i ON i.habit_id = r.habit_id
+                            LEFT JOIN habits h ON h.habit_id = r.habit_id;
+                        """, (habit_ids, user_id, current_date, user_id))
+            rows = cursor.fetchall()
+
+            statuses = {str(row["habit_id"]): row["status"] for row in rows}
+            added = [habit_id for habit_id, status in statuses.items() if status == "added"]
+            scopes = cache_scopes(user_id, rows[0]["location_cell"]) if rows else []
+            events.notify_many(cursor, "enrolled", [
+                {"user_id": user_id, "habit_id": habit_id, "scopes": scopes} for habit_id in added
+            ])
+
+        conn.commit()
+
+        if added:
+            response_cache.invalidate(f"user:{user_id}")
+            location_cell = rows[0]["location_cell"]
+            if location_cell:
+                response_cache.invalidate(f"cell:{location_cell}")
+
+        return [{"habit_id": habit_id, "status": statuses[habit_id]} for habit_id in dict.fromkeys(habit_ids)]
+
+    except psycopg2.Error as e:
+        if conn:
+            conn.rollback()
+        logger.error(f"500: Internal server error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+    finally:
+        if conn:
+            db_instance.release_connection(conn)
+
+
+def get_user_habits_endpoint(token: str):
+    payload = utils.verify_decode_token(token=token)
+    cache_scope = f"user:{payload['sub']}"
+
+    cached, generation = response_cache.get(cache_scope, "habits")
+    if cached is not None:
+        return cached
+
+    try:
+        conn = db_instance.get_connection()
+
+        with conn.cursor() as cursor:
             cursor.execute("""
                             SELECT uh.user_habit_id, uh.habit_id, uh.start_date,
                             uh.current_streak, h.habit_name, h.description
@@ -186,12 +306,10 @@ def get_user_habits_endpoint(token: str):
                             JOIN habits h ON uh.habit_id = h.habit_id
                             WHERE uh.user_id = %s;
                         """, (payload["sub"],))
-            habits_data = cursor.fetchall()
-        
-            if habits_data:
-                return habits_data
-        
-        return []
+            habits_data = fetchall_dicts(cursor)
+
+        response_cache.set(cache_scope, "habits", habits_data, generation, ttl=CACHE_TTL)
+        return habits_data
 
     except psycopg2.Error as e:
         if conn:
@@ -204,26 +322,19 @@ def get_user_habits_endpoint(token: str):
             db_instance.release_connection(conn)
 
 
-async def post_user_habit_log_endpoint(request: Request, user_habit_id: str, image_file: UploadFile, token: str):
-    payload = utils.verify_decode_token(token=token)
-    current_date = datetime.date.today()
+def caption_image_embedding(file_content: bytes, processor, blip_model, sentence_model, device):
+    """Caption an image with BLIP and embed the caption. Blocking, runs on the inference pool."""
+    image = Image.open(BytesIO(file_content)).convert("RGB")
 
-    sentence_model = request.app.state.sentence_model
-    blip_model = request.app.state.blip_model
-    processor = request.app.state.blip_processor
-    device = request.app.state.device
+    inputs = processor(images=image, return_tensors="pt").to(device)
+    output = blip_model.generate(**inputs)
+    caption = processor.decode(output[0], skip_special_tokens=True)
 
-    try:
-        file_content = await image_file.read()
-        image = Image.open(BytesIO(file_content)).convert("RGB")
+    return sentence_model.encode(caption)
 
-        inputs = processor(images=image, return_tensors="pt").to(device)
-        output = blip_model.generate(**inputs)
-        caption = processor.decode(output[0], skip_special_tokens=True)
-    
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"BLIP captioning error: {str(e)}")
 
+def log_verified_habit(user_id: str, user_habit_id: str, caption_embedding, current_date: datetime.date):
+    """Match a caption embedding against the habit and update the streak. Blocking, runs on the threadpool."""
     try:
         conn = db_instance.get_connection()
 
@@ -237,7 +348,8 @@ async def post_user_habit_log_endpoint(request: Request, user_habit_id: str, ima
                                 );""", (user_habit_id,))
             embeddings = cursor.fetchone()["embeddings"]
 
-        caption_embedding = sentence_model.encode(caption)
+        # Packed float32 rows, see db_schemas/06_habits_embeddings_f32.sql
+        embeddings = np.frombuffer(embeddings, dtype="<f4").reshape(-1, caption_embedding.shape[-1])
 
         # Compute cosine similarity
         similarities = util.cos_sim(caption_embedding, embeddings)
@@ -265,8 +377,10 @@ async def post_user_habit_log_endpoint(request: Request, user_habit_id: str, ima
 
                 # Update the current streak
                 cursor.execute("""
-                    SELECT current_streak, last_streak_date FROM user_habits 
-                    WHERE user_habit_id = %s
+                    SELECT uh.user_id, uh.habit_id, uh.current_streak, uh.last_streak_date, u.location_cell
+                    FROM user_habits uh
+                    JOIN users u ON uh.user_id = u.user_id
+                    WHERE uh.user_habit_id = %s
                     """, (user_habit_id,))
                 streak_data = cursor.fetchone()
                 current_streak = streak_data["current_streak"]
@@ -299,7 +413,17 @@ async def post_user_habit_log_endpoint(request: Request, user_habit_id: str, ima
                     SET current_streak = %s, last_streak_date = %s 
                     WHERE user_habit_id = %s
                     """, (new_streak, current_date, user_habit_id))
+
+                events.notify(cursor, "streak",
+                              user_id=streak_data["user_id"],
+                              habit_id=streak_data["habit_id"],
+                              user_habit_id=user_habit_id,
+                              current_streak=new_streak,
+                              scopes=cache_scopes(user_id, streak_data["location_cell"]))
             conn.commit()
+            response_cache.invalidate(f"user:{user_id}")
+            if streak_data["location_cell"]:
+                response_cache.invalidate(f"cell:{streak_data['location_cell']}")
             return {
                 "detail": "Habit streak updated successfully"
             }
@@ -317,12 +441,35 @@ async def post_user_habit_log_endpoint(request: Request, user_habit_id: str, ima
             db_instance.release_connection(conn)
 
 
+async def post_user_habit_log_endpoint(request: Request, user_habit_id: str, image_file: UploadFile, token: str):
+    payload = utils.verify_decode_token(token=token)
+    current_date = datetime.date.today()
+
+    sentence_model = request.app.state.sentence_model
+    blip_model = request.app.state.blip_model
+    processor = request.app.state.blip_processor
+    device = request.app.state.device
+
+    # Bound concurrent model work, requests beyond the queue are shed with 503
+    async with inference_admission.admit(payload["sub"]):
+        try:
+            file_content = await image_file.read()
+            caption_embedding = await inference_admission.run(
+                caption_image_embedding, file_content, processor, blip_model, sentence_model, device)
+
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"BLIP captioning error: {str(e)}")
+
+    # Database work and similarity scoring block, keep them off the event loop
+    return await run_in_threadpool(log_verified_habit, payload["sub"], user_habit_id, caption_embedding, current_date)
+
+
 def get_leaderboard_endpoint(habit_id:str, token: str):
     payload = utils.verify_decode_token(token=token)
     try:
         conn = db_instance.get_connection()
 
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        with conn.cursor() as cursor:
             cursor.execute("""
                             SELECT u.username, uh.current_streak
                             FROM user_habits uh
@@ -331,7 +478,7 @@ def get_leaderboard_endpoint(habit_id:str, token: str):
                             ORDER BY current_streak DESC
                             LIMIT 10;
                         """, (habit_id,))
-            leaderboard_data = cursor.fetchall()
+            leaderboard_data = fetchall_dicts(cursor)
         
             if leaderboard_data:
                 return leaderboard_data
@@ -352,6 +499,12 @@ def get_leaderboard_endpoint(habit_id:str, token: str):
 def get_user_streaks_endpoint(token):
     payload = utils.verify_decode_token(token=token)
     user_id = payload["sub"]
+    cache_scope = f"user:{user_id}"
+
+    cached, generation = response_cache.get(cache_scope, "streaks")
+    if cached is not None:
+        return cached
+
     try:
         today = datetime.date.today()
         start_of_week = today - datetime.timedelta(days=today.weekday())  # Monday
@@ -359,15 +512,14 @@ def get_user_streaks_endpoint(token):
         week_day_names = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
         conn = db_instance.get_connection()
 
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        with conn.cursor() as cursor:
             cursor.execute("""
                             SELECT uh.user_habit_id, h.habit_name
                             FROM user_habits uh
                             JOIN habits h ON uh.habit_id = h.habit_id
                             WHERE uh.user_id = %s;
                            """, (user_id,))
-            user_habits = cursor.fetchall()
-            user_habit_map = {habit["user_habit_id"]: habit["habit_name"] for habit in user_habits}
+            user_habit_map = dict(cursor.fetchall())
             user_habit_ids = list(user_habit_map.keys())
 
             if not user_habit_ids:
@@ -384,9 +536,7 @@ def get_user_streaks_endpoint(token):
         
         # Organize logs by user_habit_id
         logs_by_habit = {}
-        for log in logs:
-            habit_id = log["user_habit_id"]
-            performed_at = log["performed_at"]
+        for habit_id, performed_at in logs:
             if habit_id not in logs_by_habit:
                 logs_by_habit[habit_id] = set()
             logs_by_habit[habit_id].add(performed_at)
@@ -400,6 +550,8 @@ def get_user_streaks_endpoint(token):
             }
             result.append({"habit_name": habit_name, "breakdown": breakdown})
 
+        # The weekly breakdown depends on today's date, so never serve it past midnight
+        response_cache.set(cache_scope, "streaks", result, generation, ttl=min(CACHE_TTL, seconds_until_midnight()))
         return result
         
     except psycopg2.Error as e:
@@ -414,29 +566,48 @@ def get_user_streaks_endpoint(token):
 
 def update_user_location_endpoint(loc: models.UpdateLocationRequest, token: str):
     payload = utils.verify_decode_token(token=token)
-    user_id = payload["sub"]
-
-    point = f"SRID=4326;POINT({loc.longitude} {loc.latitude})"
-
-    try:
-        conn = db_instance.get_connection()
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                "UPDATE users SET location = ST_GeomFromText(%s, 4326) WHERE user_id = %s",
-                (point, user_id),
-            )
-            conn.commit()
-        return {"detail": "User location updated"}
 
-    except psycopg2.Error as e:
-        if conn:
-            conn.rollback()
-        logger.error(f"500: Internal server error: {str(e)}")
-        raise HTTPException(status_code=500, detail="Internal server error")
-
-    finally:
-        if conn:
-            db_instance.release_connection(conn)
+    # Written in bulk by the location buffer, see location_buffer.py
+    location_buffer.add(payload["sub"], loc.latitude, loc.longitude)
+    return {"detail": "User location updated"}
+
+
+def _nearby_candidates(cursor, habit_id: str, cells: List[str]):
+    """Users enrolled in a habit within the given cells, cached per cell."""
+    candidates = {}
+    generations = {}
+    for cell in cells:
+        cached, generations[cell] = response_cache.get(f"cell:{cell}", f"habit:{habit_id}")
+        if cached is not None:
+            candidates[cell] = cached
+    missing = [cell for cell in cells if cell not in candidates]
+
+    if missing:
+        cursor.execute("""
+            SELECT u.location_cell, u.user_id, u.username, uh.current_streak,
+            ST_X(u.location) AS lng, ST_Y(u.location) AS lat
+            FROM users u
+            JOIN user_habits uh
+            ON u.user_id = uh.user_id
+            WHERE uh.habit_id = %s
+            AND u.location_cell = ANY(%s)
+        """, (habit_id, missing))
+
+        fetched = {cell: [] for cell in missing}
+        for row in cursor.fetchall():
+            fetched[row["location_cell"]].append({
+                "user_id": str(row["user_id"]),
+                "username": row["username"],
+                "current_streak": row["current_streak"],
+                "lng": row["lng"],
+                "lat": row["lat"],
+            })
+
+        for cell, rows in fetched.items():
+            response_cache.set(f"cell:{cell}", f"habit:{habit_id}", rows, generations[cell], ttl=CACHE_TTL)
+        candidates.update(fetched)
+
+    return [candidate for cell in cells for candidate in candidates[cell]]
 
 
 def get_leaderboard_nearby_endpoint(habit_id: str, token: str):
@@ -446,24 +617,50 @@ def get_leaderboard_nearby_endpoint(habit_id: str, token: str):
         conn = db_instance.get_connection()
 
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("""
-                SELECT ST_X(location) AS lng, ST_Y(location) AS lat
-                FROM users
-                WHERE user_id = %s
-            """, (user_id,))
-            user_loc = cursor.fetchone()
-
-            if not user_loc or None in user_loc:
-                raise HTTPException(status_code=400, detail="User location is not set.")
-            
-            lng = user_loc["lng"] # X = lng,
-            lat = user_loc["lat"] # Y = lat
-
-            # Query nearby users (excluding the current user)
+            pending = location_buffer.pending_location(user_id)
+            if pending:
+                lat, lng = pending
+            else:
+                cursor.execute("""
+                    SELECT ST_X(location) AS lng, ST_Y(location) AS lat
+                    FROM users
+                    WHERE user_id = %s
+                """, (user_id,))
+                user_loc = cursor.fetchone()
+
+                if not user_loc or user_loc["lng"] is None or user_loc["lat"] is None:
+                    raise HTTPException(status_code=400, detail="User location is not set.")
+
+                lng = user_loc["lng"] # X = lng,
+                lat = user_loc["lat"] # Y = lat
+
+            cell = geo.geohash_encode(lat, lng)
+
+            # Only scan the caller's cell and its neighbors
+            nearby = sorted(
+                (
+                    {
+                        "username": candidate["username"],
+                        "current_streak": candidate["current_streak"],
+                        "distance": geo.haversine(lat, lng, candidate["lat"], candidate["lng"]),
+                    }
+                    for candidate in _nearby_candidates(cursor, habit_id, geo.geohash_neighbors(cell))
+                    if candidate["user_id"] != user_id
+                ),
+                key=lambda row: row["distance"],
+            )[:NEARBY_LIMIT]
+
+            # Users outside the neighborhood could still be closer than the farthest
+            # result, fall back to a full scan when the neighborhood can't prove otherwise
+            if len(nearby) == NEARBY_LIMIT and nearby[-1]["distance"] <= geo.neighborhood_radius(cell):
+                return nearby
+
+            # Query nearby users (excluding the current user), measured on the sphere
+            # like geo.haversine so both paths report the same distances
             cursor.execute("""
                 SELECT u.username, uh.current_streak,
                 ST_Distance(u.location::geography,
-                        ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography) AS distance
+                        ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography, false) AS distance
                 FROM users u
                 JOIN user_habits uh
                 ON u.user_id=uh.user_id
@@ -471,8 +668,8 @@ def get_leaderboard_nearby_endpoint(habit_id: str, token: str):
                 AND uh.user_id != %s 
                 AND location IS NOT NULL
                 ORDER BY distance
-                LIMIT 5
-            """, (lng, lat, habit_id, user_id))
+                LIMIT %s
+            """, (lng, lat, habit_id, user_id, NEARBY_LIMIT))
 
             results = cursor.fetchall()
             return results
@@ -487,4 +684,65 @@ def get_leaderboard_nearby_endpoint(habit_id: str, token: str):
 
     finally:
         if conn:
-            db_instance.release_connection(conn)
\ No newline at end of file
+            db_instance.release_connection(conn)
+
+
+async def stream_events_endpoint(request: Request, habit_ids: List[str], token: str):
+    payload = utils.verify_decode_token(token=token)
+
+    if len(habit_ids) > EVENTS_MAX_HABITS:
+        raise HTTPException(status_code=400, detail=f"At most {EVENTS_MAX_HABITS} habits can be subscribed to")
+    try:
+        # Canonical form, matching the habit_ids sent in events
+        habit_ids = [str(uuid.UUID(habit_id)) for habit_id in habit_ids]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid habit_id")
+
+    subscription = event_broker.subscribe(payload["sub"], habit_ids)
+
+    try:
+        snapshots = [
+            {"type": "leaderboard", "habit_id": habit_id,
+             "updated": await run_in_threadpool(event_broker.leaderboard_snapshot, habit_id),
+             "removed": []}
+            for habit_id in subscription.habit_ids
+        ]
+    except psycopg2.Error as e:
+        event_broker.unsubscribe(subscription)
+        logger.error(f"500: Internal server error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+    def format_event(event):
+        return f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+    async def event_stream():
+        try:
+            for snapshot in snapshots:
+                yield format_event(snapshot)
+
+            while not subscription.closed:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), timeout=EVENTS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+
+                if event is None:
+                    break
+                yield format_event(event)
+
+        finally:
+            event_broker.unsubscribe(subscription)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def get_inference_metrics_endpoint(token: str):
+    payload = utils.verify_decode_token(token=token)
+    return inference_admission.metrics()
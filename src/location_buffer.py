@@ -0,0 +1,133 @@
+import os
+import logging
+import threading
+
+import psycopg2
+from psycopg2 import sql, pool
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+
+import geo
+import events
+
+
+logger = logging.getLogger()
+load_dotenv()
+
+LOCATION_MIN_DISTANCE = float(os.getenv("LOCATION_MIN_DISTANCE", "50"))
+LOCATION_FLUSH_INTERVAL = float(os.getenv("LOCATION_FLUSH_INTERVAL", "5"))
+
+# Rows whose stored location is within min_distance of the new point are left alone,
+# so the database, not a single worker's memory, decides what counts as a move
+FLUSH_QUERY = sql.SQL("""
+    UPDATE users u
+    SET location = ST_SetSRID(ST_MakePoint(v.lng, v.lat), 4326), location_cell = v.cell
+    FROM (VALUES %s) AS v(user_id, lng, lat, cell), users old
+    WHERE u.user_id = v.user_id::uuid AND old.user_id = u.user_id
+    AND (old.location IS NULL OR NOT ST_DWithin(
+        old.location::geography, ST_SetSRID(ST_MakePoint(v.lng, v.lat), 4326)::geography, {min_distance}))
+    RETURNING old.location_cell AS old_cell, u.location_cell AS new_cell
+""")
+
+
+class LocationBuffer:
+    """
+    Coalesces location updates and writes them in bulk.
+
+    Only the latest point per user survives a flush window. A background thread writes
+    everything pending with a single UPDATE every LOCATION_FLUSH_INTERVAL seconds, which
+    skips users whose stored location is closer than LOCATION_MIN_DISTANCE.
+    """
+
+    def __init__(self, database, on_cells_changed=None,
+                 min_distance: float = LOCATION_MIN_DISTANCE, flush_interval: float = LOCATION_FLUSH_INTERVAL):
+        self.database = database
+        self.on_cells_changed = on_cells_changed
+        self.min_distance = min_distance
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+
+    def add(self, user_id: str, lat: float, lng: float):
+        """Buffer a point, replacing any point of the user still waiting to be written."""
+        with self._lock:
+            self._pending[user_id] = (lat, lng)
+
+
+    def pending_location(self, user_id: str):
+        """Latest (lat, lng) of a user that is not yet written to the database, if any."""
+        with self._lock:
+            return self._pending.get(user_id)
+
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+
+            if not batch:
+                return
+
+            rows = [(user_id, lng, lat, geo.geohash_encode(lat, lng)) for user_id, (lat, lng) in batch.items()]
+            conn = None
+            try:
+                conn = self.database.get_connection()
+                with conn.cursor() as cursor:
+                    query = FLUSH_QUERY.format(min_distance=sql.Literal(self.min_distance))
+                    changed = execute_values(cursor, query, rows, page_size=len(rows), fetch=True)
+                    cells = {cell for pair in changed for cell in pair if cell}
+                    # Lets the other workers drop their cached candidates for these cells
+                    if cells:
+                        events.notify(cursor, "invalidate", scopes=[f"cell:{cell}" for cell in cells])
+                conn.commit()
+
+            except (psycopg2.OperationalError, psycopg2.InterfaceError, pool.PoolError) as e:
+                if conn and not conn.closed:
+                    conn.rollback()
+                logger.error(f"Failed to flush {len(batch)} location updates, retrying: {str(e)}")
+                with self._lock:
+                    # Keep the points for the next flush unless newer ones arrived meanwhile
+                    for user_id, point in batch.items():
+                        self._pending.setdefault(user_id, point)
+                return
+
+            except psycopg2.Error as e:
+                # Bad input would fail every later batch too, so give up on this one
+                if conn:
+                    conn.rollback()
+                logger.error(f"Dropped {len(batch)} location updates: {str(e)}")
+                return
+
+            finally:
+                if conn:
+                    self.database.release_connection(conn)
+
+            if self.on_cells_changed:
+                self.on_cells_changed(cells)
+
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="location-buffer", daemon=True)
+        self._thread.start()
+
+
+    def stop(self):
+        """Stop the background thread and write whatever is still pending."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.flush_interval + 5)
+            self._thread = None
+        self.flush()
+
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Location flush error: {str(e)}")
@@ -1,10 +1,16 @@
+import os
+import gc
+import signal
+import asyncio
 import logging
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from uvicorn import run
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+import handler
 from routes import router
 
 from transformers import BlipProcessor, BlipForConditionalGeneration
@@ -13,8 +19,87 @@ import torch
 
 
 logger = logging.getLogger()
+load_dotenv()
 
-app = FastAPI()
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS", "false").lower() in ("1", "true", "yes")
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "30"))
+
+
+def load_models():
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
+    blip_model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base").to(device)
+    blip_model.eval()
+
+    sentence_model = SentenceTransformer('all-MiniLM-L6-v2', device=device)
+
+    return {
+        "blip_model": blip_model,
+        "blip_processor": processor,
+        "sentence_model": sentence_model,
+        "device": device,
+    }
+
+
+# With `gunicorn --preload` this module is imported once in the master before workers
+# are forked, so the read-only weights are shared copy-on-write instead of loaded per
+# worker. CUDA can't be initialized before a fork, so GPU hosts load per worker.
+preloaded_models = None
+if PRELOAD_MODELS:
+    # Ask NVML for the device count, the default check initializes CUDA in the master
+    # and forked workers could then no longer use the GPU
+    os.environ["PYTORCH_NVML_BASED_CUDA_CHECK"] = "1"
+    if torch.cuda.is_available():
+        logger.error("PRELOAD_MODELS is ignored on CUDA hosts, models are loaded per worker")
+    else:
+        preloaded_models = load_models()
+        # Keep the garbage collector from touching (and so copying) the preloaded objects
+        gc.freeze()
+
+
+def install_drain_signal_handler():
+    """
+    On SIGTERM, stop admitting inference and end the event streams before the server
+    waits for open connections, then hand over to the server's own handler.
+    """
+    loop = asyncio.get_running_loop()
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handle_sigterm(signum, frame):
+        logger.info("SIGTERM received, draining")
+        handler.inference_admission.draining = True
+        loop.call_soon_threadsafe(handler.event_broker.close_subscriptions)
+        if callable(previous):
+            previous(signum, frame)
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Store in FastAPI app state
+    for name, value in (preloaded_models or load_models()).items():
+        setattr(app.state, name, value)
+
+    # Per worker resources, created after any fork
+    handler.db_instance.open_pool()
+    handler.event_broker.start(asyncio.get_running_loop())
+    handler.location_buffer.start()
+    install_drain_signal_handler()
+
+    try:
+        yield
+
+    finally:
+        await handler.inference_admission.drain(SHUTDOWN_DRAIN_TIMEOUT)
+        handler.location_buffer.stop()
+        handler.event_broker.stop()
+        handler.response_cache.close()
+        handler.db_instance.close_pool()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.include_router(router)
 
@@ -27,20 +112,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.on_event("startup")
-async def startup_event():
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
-    processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-    blip_model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base").to(device)
-
-    sentence_model = SentenceTransformer('all-MiniLM-L6-v2', device=device)
-
-    # Store in FastAPI app state
-    app.state.blip_model = blip_model
-    app.state.blip_processor = processor
-    app.state.sentence_model = sentence_model
-    app.state.device = device
 
 @app.get("/")
 def root():
@@ -49,7 +120,6 @@ def root():
 
 if __name__ == "__main__":
     logger.info("Starting the FastAPI application...")
-    load_dotenv()
 
     # Use uvicorn to run the FastAPI application
-    run(app, host="0.0.0.0", port=8000, log_level="info")
\ No newline at end of file
+    run(app, host="0.0.0.0", port=8000, log_level="info")
@@ -1,5 +1,5 @@
-from typing import Optional, Dict
-from pydantic import BaseModel
+from typing import Optional, Dict, List
+from pydantic import BaseModel, Field
 import datetime
 
 
@@ -33,6 +33,15 @@ class PostUserHabitRequest(BaseModel):
     habit_id: str
 
 
+class PostUserHabitsRequest(BaseModel):
+    habit_ids: List[str] = Field(max_length=50)
+
+
+class PostUserHabitsResponse(BaseModel):
+    habit_id: str
+    status: str  # "added", "already_added" or "not_found"
+
+
 class GetUserHabitsResponse(BaseModel):
     user_habit_id: str
     habit_id: str
@@ -53,11 +62,25 @@ class GetStreakResponse(BaseModel):
 
 
 class UpdateLocationRequest(BaseModel):
-    latitude: float
-    longitude: float
+    latitude: float = Field(ge=-90, le=90)
+    longitude: float = Field(ge=-180, le=180)
 
 
 class GetLeaderboardNearbyResponse(BaseModel):
     username: str
     current_streak: int
     distance: float
+
+
+class GetInferenceMetricsResponse(BaseModel):
+    active: int
+    queued: int
+    max_concurrency: int
+    max_queue: int
+    admitted_total: int
+    queued_total: int
+    shed_total: int
+    shed_queue_full_total: int
+    shed_user_limit_total: int
+    shed_timeout_total: int
+    shed_draining_total: int
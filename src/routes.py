@@ -1,8 +1,9 @@
+import utils
 import models
 import handler
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends, Query, Request
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi import File, UploadFile, Form
 
@@ -49,7 +50,7 @@ def user_login(user: models.LoginRequest):
     },
 )
 def get_habits(token: str = Depends(oauth2_scheme)):
-    return handler.get_habits_endpoint(token)
+    return utils.list_response(handler.get_habits_endpoint(token))
 
 
 @router.post(
@@ -65,6 +66,19 @@ def post_user_habit(habit: models.PostUserHabitRequest, token: str = Depends(oau
     return handler.post_user_habit_endpoint(habit, token)
 
 
+@router.post(
+    "/user/habits",
+    response_model=List[models.PostUserHabitsResponse],
+    responses={
+        400: {"description": "Invalid habit_id"},
+        401: {"description": "Unauthorized"},
+        500: {"description": "Internal server error"},
+    },
+)
+def post_user_habits(habits: models.PostUserHabitsRequest, token: str = Depends(oauth2_scheme)):
+    return handler.post_user_habits_endpoint(habits, token)
+
+
 @router.get(
     "/user/habits",
     response_model=List[Optional[models.GetUserHabitsResponse]],
@@ -74,7 +88,7 @@ def post_user_habit(habit: models.PostUserHabitRequest, token: str = Depends(oau
     },
 )
 def get_user_habits(token: str = Depends(oauth2_scheme)):
-    return handler.get_user_habits_endpoint(token)
+    return utils.list_response(handler.get_user_habits_endpoint(token))
 
 
 @router.post(
@@ -84,7 +98,9 @@ def get_user_habits(token: str = Depends(oauth2_scheme)):
         401: {"description": "Unauthorized"},
         409: {"description": "You have already logged this habit for today"},
         400: {"description": "Habit was not verified due to incorrect image"},
+        429: {"description": "Too many habit verifications in progress for this user"},
         500: {"description": "Internal server error"},
+        503: {"description": "Server is busy verifying other habits, please retry shortly"},
     },
 )
 async def post_user_habit_log(request: Request, user_habit_id: str = Form(...), image_file: UploadFile = File(...), token: str = Depends(oauth2_scheme)):
@@ -101,7 +117,7 @@ async def post_user_habit_log(request: Request, user_habit_id: str = Form(...),
     },
 )
 def get_leaderboard(habit_id: str, token: str = Depends(oauth2_scheme)):
-    return handler.get_leaderboard_endpoint(habit_id, token)
+    return utils.list_response(handler.get_leaderboard_endpoint(habit_id, token))
 
 
 @router.get(
@@ -113,7 +129,7 @@ def get_leaderboard(habit_id: str, token: str = Depends(oauth2_scheme)):
     },
 )
 def get_user_streaks(token: str = Depends(oauth2_scheme)):
-    return handler.get_user_streaks_endpoint(token)
+    return utils.list_response(handler.get_user_streaks_endpoint(token))
 
 @router.patch("/user/location",
     response_model=models.Response,
@@ -138,3 +154,27 @@ def update_user_location(loc: models.UpdateLocationRequest, token: str = Depends
 )
 def get_leaderboard_nearby(habit_id: str, token: str = Depends(oauth2_scheme)):
     return handler.get_leaderboard_nearby_endpoint(habit_id, token)
+
+
+
+@router.get("/events",
+    responses={
+        200: {"description": "Server-Sent Events stream of leaderboard diffs and own streak updates",
+              "content": {"text/event-stream": {}}},
+        400: {"description": "Invalid habit_id or too many habits"},
+        401: {"description": "Unauthorized"},
+        500: {"description": "Internal server error"},
+    },
+)
+async def stream_events(request: Request, habit_id: List[str] = Query([]), token: str = Depends(oauth2_scheme)):
+    return await handler.stream_events_endpoint(request, habit_id, token)
+
+
+@router.get("/metrics/inference",
+    response_model=models.GetInferenceMetricsResponse,
+    responses={
+        401: {"description": "Unauthorized"},
+    },
+)
+def get_inference_metrics(token: str = Depends(oauth2_scheme)):
+    return handler.get_inference_metrics_endpoint(token)